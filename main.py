@@ -1,15 +1,26 @@
 import os
-import json
 import csv
 import time
+import queue
 import struct
+import random
+import asyncio
 import logging
-from datetime import datetime
-from pymodbus.client import ModbusTcpClient
+import itertools
+from datetime import datetime, timezone
+from pymodbus.client import AsyncModbusTcpClient
 from pymodbus import FramerType, ModbusException
-from flask import Flask, jsonify
+import orjson
+from quart import Quart, Response
 import sqlite3
 import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import requests
+except ImportError:
+    requests = None  # Discord-varsling deaktiveres uten requests
 # ---------------------------------------------------------------------
 # Configuration & Global State
 # ---------------------------------------------------------------------
@@ -17,7 +28,8 @@ import threading
 settingsFile = os.path.join(os.path.dirname(__file__), "settings.json")
 lastKnownValues = {}  # Cache for ASCII-verdier (f.eks. navn)
 lastReadTime = {}     # Tidspunkt for siste lesing av spesifikke registre
-latestReadings = {}
+latestReadings = {}  # Byttes ut i sin helhet hver syklus, aldri endret på stedet
+latestReadingsJson = b"{}"  # Ferdig serialisert latestReadings for API-et
 
 # Default settings matching the provided JSON structure
 settings = {
@@ -42,7 +54,8 @@ settings = {
         ],
         "port": 502,
         "retries": 3,
-        "retryDelay": 0.3
+        "retryDelay": 0.3,
+        "maxRegisterGap": 0
     },
     "powertags": [],
     "registerMap": {}
@@ -51,8 +64,8 @@ settings = {
 # Load configuration from file
 if os.path.exists(settingsFile):
     try:
-        with open(settingsFile, "r") as f:
-            fileSettings = json.load(f)
+        with open(settingsFile, "rb") as f:
+            fileSettings = orjson.loads(f.read())
             settings.update(fileSettings)
     except Exception as e:
         print(f"Failed to load settings.json: {e}")
@@ -68,12 +81,15 @@ registerMap = settings["registerMap"]
 powertags = settings["powertags"]
 thresholds = settings["thresholds"]
 
+# Kolonner for lagring; registerMap endres ikke under kjøring
+storageHeaders = ["Tag", "Timestamp"] + list(registerMap.keys())
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-app = Flask(__name__)
+app = Quart(__name__)
 
 # ---------------------------------------------------------------------
 # Discord Notifier
@@ -81,59 +97,108 @@ app = Flask(__name__)
 
 class PowerTagDiscordNotifier:
     """ Summary of function: Handles Discord webhook integration for alerts and status """
-    
-    def __init__(self, webhookUrl):
+
+    # Lavere tall sendes først; varsler går foran statusmeldinger
+    priorities = {"alert": 0, "status": 1}
+
+    def __init__(self, webhookUrl, queueSize=100, maxAttempts=5):
         self.webhookUrl = webhookUrl
         self.enabled = False
+        self.maxAttempts = maxAttempts
+        self.session = None
+        self.queue = queue.PriorityQueue(maxsize=queueSize)
+        self.sequence = itertools.count()  # Bevarer rekkefølgen innen samme prioritet
         self._Initialize()
+
+        if self.enabled:
+            self.workerThread = threading.Thread(target=self._Worker, daemon=True)
+            self.workerThread.start()
     
     def _Initialize(self):
         if not self.webhookUrl:
             logging.warning("No Discord webhook URL provided - Discord notifications disabled")
             return
+
+        if requests is None:
+            logging.warning("The requests package is not installed - Discord notifications disabled")
+            return
         
         try:
-            from discord_webhook import DiscordWebhook, DiscordEmbed
+            # Én session gjenbruker TCP/TLS-tilkoblingen for alle meldinger
+            self.session = requests.Session()
             
             # Create initialization message with limits
-            content = "🟢 **PowerTag Monitor initializing...**"
-            webhook = DiscordWebhook(url=self.webhookUrl, content=content)
-            
-            embed = DiscordEmbed(title="System Limits Configured", color=3447003)
-            embed.add_embed_field(name="Voltage Thresholds", value=f"Low: {thresholds['voltage']['low']}V\nHigh: {thresholds['voltage']['high']}V")
-            embed.add_embed_field(name="Current Threshold", value=f"High: {thresholds['current']['high']}A")
-            embed.set_timestamp()
+            payload = {
+                "content": "🟢 **PowerTag Monitor initializing...**",
+                "embeds": [self._BuildEmbed({
+                    "title": "System Limits Configured",
+                    "color": 3447003,
+                    "fields": [
+                        {"name": "Voltage Thresholds", "value": f"Low: {thresholds['voltage']['low']}V\nHigh: {thresholds['voltage']['high']}V", "inline": True},
+                        {"name": "Current Threshold", "value": f"High: {thresholds['current']['high']}A", "inline": True}
+                    ]
+                })]
+            }
+            response = self._Post(payload)
             
-            webhook.add_embed(embed)
-            response = webhook.execute()
-            
-            if response and response.status_code == 200:
+            if response is not None and response.ok:
                 self.enabled = True
                 logging.info("✅ Discord notifier initialized successfully")
         except Exception as e:
             logging.error(f"❌ Failed to initialize Discord notifier: {e}")
             self.enabled = False
+
+    def _BuildEmbed(self, embedData):
+        return {
+            "title": embedData.get('title', ''),
+            "description": embedData.get('description', ''),
+            "color": embedData.get('color', 3447003),
+            "fields": [
+                {"name": field['name'], "value": field['value'], "inline": field.get('inline', False)}
+                for field in embedData.get('fields', [])
+            ],
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+
+    def _Post(self, payload):
+        """ Summary of function: Posts a payload, waiting out Discord rate limits (HTTP 429) """
+        for _ in range(self.maxAttempts):
+            response = self.session.post(self.webhookUrl, json=payload, timeout=10)
+            if response.status_code != 429:
+                return response
+
+            try:
+                retryAfter = float(response.json().get("retry_after", 1))
+            except ValueError:
+                retryAfter = float(response.headers.get("Retry-After", 1))
+            logging.warning(f"Discord rate limit hit - retrying in {retryAfter}s")
+            time.sleep(retryAfter)
+        return None
+
+    def _Worker(self):
+        while True:
+            _, _, payload = self.queue.get()
+            try:
+                response = self._Post(payload)
+                if response is None or not response.ok:
+                    logging.error(f"Failed to send Discord embed: {getattr(response, 'status_code', 'rate limited')}")
+            except Exception as e:
+                logging.error(f"Failed to send Discord embed: {e}")
+            finally:
+                self.queue.task_done()
         
-    def SendEmbed(self, embedData):
+    def SendEmbed(self, embedData, priority="alert"):
+        """ Summary of function: Queues an embed for the background worker without blocking """
         if not self.enabled:
             return False
         
+        payload = {"username": "PowerTag Monitor", "embeds": [self._BuildEmbed(embedData)]}
         try:
-            from discord_webhook import DiscordWebhook, DiscordEmbed
-            webhook = DiscordWebhook(url=self.webhookUrl, username="PowerTag Monitor")
-            embed = DiscordEmbed(
-                title=embedData.get('title', ''),
-                description=embedData.get('description', ''),
-                color=embedData.get('color', 3447003)
-            )
-            for field in embedData.get('fields', []):
-                embed.add_embed_field(name=field['name'], value=field['value'], inline=field.get('inline', False))
-            
-            embed.set_timestamp()
-            webhook.add_embed(embed)
-            webhook.execute()
-        except Exception as e:
-            logging.error(f"Failed to send Discord embed: {e}")
+            self.queue.put_nowait((self.priorities.get(priority, 1), next(self.sequence), payload))
+        except queue.Full:
+            logging.warning("Discord queue is full - dropping embed")
+            return False
+        return True
 
     def SendStatus(self, statusType, title, description):
         colors = {'success': 3066993, 'error': 15158332, 'shutdown': 10181046}
@@ -142,12 +207,32 @@ class PowerTagDiscordNotifier:
             "description": description,
             "color": colors.get(statusType, 3447003),
             "fields": [{"name": "Time", "value": datetime.now().strftime("%H:%M:%S")}]
-        })
+        }, priority="status")
 
 # ---------------------------------------------------------------------
 # Modbus & Storage Layer
 # ---------------------------------------------------------------------
 
+registerStructs = {}  # struct.Struct per registerlengde for pakking av registre til bytes
+maxRegistersPerRead = 125  # Modbus-grense for read_input_registers
+
+def GetRegisterStruct(length):
+    """ Summary of function: Returns a cached big-endian struct for the given register count """
+    registerStruct = registerStructs.get(length)
+    if registerStruct is None:
+        registerStruct = registerStructs[length] = struct.Struct(f">{length}H")
+    return registerStruct
+
+def DecodeRegisters(valueFormat, digits=None):
+    """ Summary of function: Creates a decoder for one value at a register offset in a packed block """
+    unpackFrom = struct.Struct(valueFormat).unpack_from
+
+    def Decode(rawBytes, offset=0):
+        value = unpackFrom(rawBytes, offset * 2)[0]
+        return value if digits is None else round(value, digits)
+
+    return Decode
+
 class ModbusReader:
     """ Summary of function: Handles dynamic Modbus register communication """
     def __init__(self, client, retries=3, delay=0.3):
@@ -155,53 +240,175 @@ class ModbusReader:
         self.retries = retries
         self.delay = delay
 
-    def ReadRegisters(self, address, deviceId, count=2, registerType="input"):
+    async def ReadRegisters(self, address, deviceId, count=2, registerType="input"):
         for _ in range(self.retries):
+            # Ikke la pymodbus forsøke egen tilkobling per spørring når forbindelsen er brutt
+            if not self.client.connected:
+                return None
             try:
                 if registerType == "input":
-                    response = self.client.read_input_registers(address=address, count=count, device_id=deviceId)
+                    response = await self.client.read_input_registers(address=address, count=count, device_id=deviceId)
                 else:
-                    response = self.client.read_holding_registers(address=address, count=count, device_id=deviceId)
-
-                if response and not response.isError():
-                    return response.registers[:count]
-                time.sleep(self.delay)
+                    response = await self.client.read_holding_registers(address=address, count=count, device_id=deviceId)
             except Exception:
-                time.sleep(self.delay)
+                await asyncio.sleep(self.delay)
+                continue
+
+            if response and not response.isError():
+                # pymodbus bygger registers fra enhetens egen byte count, ikke fra count i spørringen
+                if len(response.registers) == count:
+                    return response.registers
+                logging.warning(f"Device {deviceId} returned {len(response.registers)} registers from {address}, expected {count}")
+            await asyncio.sleep(self.delay)
         return None
 
-    def ReadFloat(self, address, deviceId, length):
-        registers = self.ReadRegisters(address, deviceId, count=length, registerType="input")
-        if not registers: return None
-        return round(struct.unpack(">f", struct.pack(">HH", registers[0], registers[1]))[0], 2)
-
-    def ReadAscii(self, address, deviceId, length):
-        registers = self.ReadRegisters(address, deviceId, length, "holding")
-        if not registers: return None
-        rawBytes = bytearray()
-        for reg in registers:
-            rawBytes.extend([(reg >> 8) & 0xFF, reg & 0xFF])
+    async def ReadBlock(self, address, deviceId, count, fields):
+        """ Summary of function: Reads a merged register range once and decodes each field from it """
+        registers = await self.ReadRegisters(address, deviceId, count=count, registerType="input")
+        if registers is None:
+            return {key: None for key, _, _ in fields}
+        # Hele blokken pakkes til bytes én gang; hvert felt leses med unpack_from
+        rawBytes = GetRegisterStruct(count).pack(*registers)
+        return {key: decoder(rawBytes, offset) for key, offset, decoder in fields}
+
+    async def ReadAscii(self, address, deviceId, length):
+        registers = await self.ReadRegisters(address, deviceId, length, "holding")
+        if registers is None: return None
+        rawBytes = GetRegisterStruct(len(registers)).pack(*registers)
         return rawBytes.rstrip(b"\x00").decode("ascii", errors="ignore")
 
+class GatewaySupervisor:
+    """ Summary of function: Keeps one gateway connected, reconnecting with exponential backoff and jitter """
+    def __init__(self, gatewayName, client, notifier, checkInterval=5.0, baseDelay=1.0, maxDelay=300.0):
+        self.gatewayName = gatewayName
+        self.client = client
+        self.notifier = notifier
+        self.checkInterval = checkInterval
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.online = None  # Ukjent til første tilkoblingsforsøk
+
+    def _SetOnline(self, online):
+        # Varsle kun ved tilstandsendring, ikke for hvert forsøk
+        if online == self.online:
+            return
+        wasKnown = self.online is not None
+        self.online = online
+
+        if online:
+            logging.info(f"Modbus gateway {self.gatewayName} connected")
+            if wasKnown:
+                self.notifier.SendStatus("success", f"Gateway {self.gatewayName} online", "Modbus connection restored")
+        else:
+            logging.error(f"Modbus connection to gateway {self.gatewayName} failed - reconnecting in background")
+            self.notifier.SendStatus("error", f"Gateway {self.gatewayName} offline", "Modbus connection lost, tags on this gateway are skipped until it reconnects")
+
+    async def Connect(self):
+        try:
+            connected = await self.client.connect()
+        except Exception as e:
+            logging.warning(f"Modbus connect to gateway {self.gatewayName} raised: {e}")
+            connected = False
+        self._SetOnline(connected)
+        return connected
+
+    async def Supervise(self):
+        delay = self.baseDelay
+        while True:
+            if self.client.connected:
+                self._SetOnline(True)
+                delay = self.baseDelay
+                await asyncio.sleep(self.checkInterval)
+                continue
+
+            self._SetOnline(False)
+            if await self.Connect():
+                delay = self.baseDelay
+                continue
+
+            # Halvparten fast, halvparten tilfeldig, så flere gatewayer ikke prøver i takt
+            await asyncio.sleep(delay / 2 + random.uniform(0, delay / 2))
+            delay = min(delay * 2, self.maxDelay)
+
 def InitStorage():
-    """ Summary of function: Prepares CSV storage. Database logic can be expanded here """
+    """ Summary of function: Prepares CSV storage, or the SQLite database when databaseConnection is set """
+    if databaseUrl:
+        # Autocommit-modus; transaksjoner styres eksplisitt med BEGIN/COMMIT per syklus
+        connection = sqlite3.connect(databaseUrl, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA temp_store=MEMORY")
+
+        columnTypes = {"float": "REAL", "float64": "REAL", "int32": "INTEGER", "uint32": "INTEGER", "ascii": "TEXT"}
+        columns = ['"Tag" TEXT', '"Timestamp" REAL'] + [
+            f'"{key}" {columnTypes.get(config.get("type", "float"), "")}'.rstrip()
+            for key, config in registerMap.items()
+        ]
+        connection.execute(f"CREATE TABLE IF NOT EXISTS readings ({', '.join(columns)})")
+
+        # En eksisterende tabell fra en tidligere registerMap må ha nøyaktig samme kolonner
+        existingColumns = [row[1] for row in connection.execute("PRAGMA table_info(readings)")]
+        if existingColumns != storageHeaders:
+            connection.close()
+            raise ValueError(f"Table 'readings' in {databaseUrl} has columns {existingColumns}, expected {storageHeaders} from registerMap")
+        return connection
+
     if not os.path.exists(csvFile):
         with open(csvFile, "w", newline="") as file:
             writer = csv.writer(file)
             # Dynamic header based on registerMap keys
-            headers = ["Tag", "Timestamp"] + list(registerMap.keys())
-            writer.writerow(headers)
+            writer.writerow(storageHeaders)
+    return None
 
-def AppendData(rowDict):
-    """ Summary of function: Appends a dictionary of readings to the CSV file """
-    fileExisted = os.path.exists(csvFile)
-    headers = ["Tag", "Timestamp"] + list(registerMap.keys())
-    
-    with open(csvFile, "a", newline="") as file:
-        writer = csv.DictWriter(file, fieldnames=headers)
-        if not fileExisted:
-            writer.writeheader()
-        writer.writerow(rowDict)
+class StorageWriter:
+    """ Summary of function: Keeps storage open and writes all rows of a cycle in one batch """
+    def __init__(self, csvPath, connection=None):
+        self.headers = storageHeaders
+        self.pendingRows = []
+        self.connection = connection
+        self.file = None
+
+        if connection:
+            columns = ", ".join(f'"{header}"' for header in self.headers)
+            placeholders = ", ".join("?" for _ in self.headers)
+            self.insertSql = f"INSERT INTO readings ({columns}) VALUES ({placeholders})"
+        else:
+            # Filen åpnes én gang; InitStorage har allerede skrevet header
+            self.file = open(csvPath, "a", newline="")
+            self.writer = csv.writer(self.file)
+
+    def AppendData(self, rowDict):
+        """ Summary of function: Queues a dictionary of readings until the next Flush """
+        self.pendingRows.append([rowDict.get(header) for header in self.headers])
+
+    def Flush(self):
+        """ Summary of function: Writes queued rows in a single transaction/flush """
+        if not self.pendingRows:
+            return
+
+        # Køen tømmes før skriving, slik at en varig feil ikke gir ubegrenset vekst eller duplikater
+        rows, self.pendingRows = self.pendingRows, []
+        try:
+            if self.connection:
+                self.connection.execute("BEGIN")
+                try:
+                    self.connection.executemany(self.insertSql, rows)
+                    self.connection.execute("COMMIT")
+                except Exception:
+                    self.connection.execute("ROLLBACK")
+                    raise
+            else:
+                self.writer.writerows(rows)
+                self.file.flush()
+        except Exception as e:
+            logging.error(f"Failed to write {len(rows)} readings, dropping them: {e}")
+
+    def Close(self):
+        self.Flush()
+        if self.connection:
+            self.connection.close()
+        if self.file:
+            self.file.close()
 
 # ---------------------------------------------------------------------
 # Business Logic
@@ -224,77 +431,174 @@ def CheckAlerts(readings):
         
     return alerts
 
-def Run():
+def LogStorageError(future):
+    """ Summary of function: Logs failures from writes running on the storage thread """
+    if future.exception():
+        logging.error(f"Failed to write readings: {future.exception()}")
+
+# Typer som dekodes fra sammenslåtte input-registerblokker hver syklus: (dekoder, antall registre)
+blockDecoders = {
+    "float": (DecodeRegisters(">f", digits=2), 2),
+    "float64": (DecodeRegisters(">d", digits=2), 4),
+    "int32": (DecodeRegisters(">i"), 2),
+    "uint32": (DecodeRegisters(">I"), 2)
+}
+
+# Typer som leses enkeltvis fra holding-registre og caches i asciiReadInterval
+cachedReaders = {
+    "ascii": ModbusReader.ReadAscii
+}
+
+def ValidateRegisterMap():
+    """ Summary of function: Fails at startup if registerMap contains an unsupported type, register or length """
+    for key, config in registerMap.items():
+        regType = config.get("type", "float")
+        if regType in blockDecoders:
+            minimumLength = blockDecoders[regType][1]
+        elif regType in cachedReaders:
+            minimumLength = 1
+        else:
+            raise ValueError(f"Unsupported register type '{regType}' for '{key}' in registerMap")
+
+        # bool er en subklasse av int i Python, men aldri en gyldig adresse eller lengde
+        register = config.get("register")
+        if not isinstance(register, int) or isinstance(register, bool) or register < 0:
+            raise ValueError(f"Register for '{key}' in registerMap must be a non-negative integer, got {register!r}")
+
+        length = config.get("length", minimumLength)
+        if not isinstance(length, int) or isinstance(length, bool) or not minimumLength <= length <= maxRegistersPerRead:
+            raise ValueError(f"Length for '{key}' ({regType}) in registerMap must be an integer from {minimumLength} to {maxRegistersPerRead}, got {length!r}")
+
+def MergeRegisterBlocks(blockRegisters, maxGap):
+    """ Summary of function: Coalesces block-read registers into as few Modbus reads as possible """
+    blocks = []
+    for key, regAddr, registerLength, decoder in sorted(blockRegisters, key=lambda entry: entry[1]):
+        if blocks:
+            startAddr, count, fields = blocks[-1]
+            endAddr = regAddr + registerLength
+            # Slå sammen hvis hullet er lite nok og spørringen holder seg innenfor 125 registre
+            if regAddr - (startAddr + count) <= maxGap and endAddr - startAddr <= maxRegistersPerRead:
+                fields.append((key, regAddr - startAddr, decoder))
+                blocks[-1] = (startAddr, max(count, endAddr - startAddr), fields)
+                continue
+        blocks.append((regAddr, registerLength, [(key, 0, decoder)]))
+    return blocks
+
+def BuildReadPlans(modbusReaders):
+    """ Summary of function: Resolves registerMap into a fixed read plan per powertag at startup """
+    maxGap = settings["modbus"].get("maxRegisterGap", 0)
+    readPlans = []
+    for tagInfo in powertags:
+        tagName = tagInfo["tagName"]
+        registerReader = modbusReaders[tagInfo["gatewayName"]]
+
+        blockRegisters = []
+        cachedRegisters = []
+        for key, config in registerMap.items():
+            regType = config.get("type", "float")
+            if regType in blockDecoders:
+                decoder, registerCount = blockDecoders[regType]
+                blockRegisters.append((key, config["register"], config.get("length", registerCount), decoder))
+            else:
+                readFunction = partial(cachedReaders[regType], registerReader)
+                cachedRegisters.append((key, config["register"], config.get("length", 2), f"{tagName}_{key}", readFunction))
+
+        registerBlocks = MergeRegisterBlocks(blockRegisters, maxGap)
+        readPlans.append((tagName, tagInfo["gatewayName"], tagInfo["deviceId"], registerReader, registerBlocks, cachedRegisters))
+    return readPlans
+
+async def ReadTag(readPlan, cycleStart):
+    """ Summary of function: Reads every register in the read plan for a single powertag """
+    tagName, _, deviceId, registerReader, registerBlocks, cachedRegisters = readPlan
+    currentRow = {"Tag": tagName, "Timestamp": cycleStart}
+
+    for startAddr, count, fields in registerBlocks:
+        if registerReader.client.connected:
+            currentRow.update(await registerReader.ReadBlock(startAddr, deviceId, count, fields))
+        else:
+            # Forbindelsen falt midt i syklusen; resten av tag-en leses ikke
+            currentRow.update((key, None) for key, _, _ in fields)
+
+    for key, regAddr, registerLength, cacheKey, readFunction in cachedRegisters:
+        if registerReader.client.connected and cycleStart - lastReadTime.get(cacheKey, 0) > asciiReadInterval:
+            val = await readFunction(regAddr, deviceId, registerLength)
+            if val:
+                lastKnownValues[cacheKey] = val
+                lastReadTime[cacheKey] = cycleStart
+        currentRow[key] = lastKnownValues.get(cacheKey, "Unknown")
+
+    return currentRow
+
+async def Run():
     """ Summary of function: Main dynamic loop that also updates the global latestReadings object """
-    global latestReadings
-    InitStorage()
+    global latestReadings, latestReadingsJson
+    ValidateRegisterMap()
+
+    # All lagring skjer på én egen tråd, slik at disk-I/O ikke forsinker avlesningen
+    storageExecutor = ThreadPoolExecutor(max_workers=1)
+    connection = await asyncio.wrap_future(storageExecutor.submit(InitStorage))
+    storage = await asyncio.wrap_future(storageExecutor.submit(StorageWriter, csvFile, connection))
     
+    # Oppstartsmeldingen sendes synkront (med retry ved 429), så den må ikke blokkere event loop-en
+    discord = await asyncio.to_thread(PowerTagDiscordNotifier, discordWebhookUrl)
+    lastAlertTime = {}
+
     gateWays = settings["modbus"]["gateways"]
     modbusClients = {}
     modbusReaders = {}
+    gatewaySupervisors = {}
     
     for gateway in gateWays:
         gatewayIp = gateway["ip"]
         gatewayName = gateway["name"]
         
-        client = ModbusTcpClient(gatewayIp, port=settings["modbus"]["port"], framer=FramerType.SOCKET)
+        # reconnect_delay=0 slår av pymodbus sin automatiske gjenoppkobling i bakgrunnen.
+        # execute() kaller likevel connect() selv om transporten mangler, så ReadTag og
+        # ReadRegisters sjekker client.connected før hver spørring og lar GatewaySupervisor koble til igjen.
+        client = AsyncModbusTcpClient(gatewayIp, port=settings["modbus"]["port"], framer=FramerType.SOCKET, reconnect_delay=0)
         
         modbusClients[gatewayName] = client
-    
-        if not client.connect():
-            logging.error("Modbus connection failed")
-            return
+        gatewaySupervisors[gatewayName] = GatewaySupervisor(gatewayName, client, discord)
     
         reader = ModbusReader(client, settings["modbus"]["retries"], settings["modbus"]["retryDelay"])
         
         modbusReaders[gatewayName] = reader
+
+    # Første tilkobling før syklusen starter; gatewayer som feiler prøves igjen i bakgrunnen
+    await asyncio.gather(*(supervisor.Connect() for supervisor in gatewaySupervisors.values()))
+    supervisorTasks = [asyncio.create_task(supervisor.Supervise()) for supervisor in gatewaySupervisors.values()]
     
-    discord = PowerTagDiscordNotifier(discordWebhookUrl)
-    lastAlertTime = {}
+    readPlans = BuildReadPlans(modbusReaders)
+
+    # Fast takt basert på monotonic klokke; påvirkes ikke av NTP-justeringer
+    nextDeadline = time.monotonic()
 
     try:
         while True:
+            # Tidsstempel for lagring/API; takten styres av nextDeadline
             cycleStart = time.time()
             # Midlertidig dict for å holde denne syklusens data
             currentCycleData = {}
 
-            for tagInfo in powertags:
-                deviceId = tagInfo["deviceId"]
-                tagName = tagInfo["tagName"]
-                gatewayName = tagInfo["gatewayName"]
-                
-                currentRow = {"Tag": tagName, "Timestamp": cycleStart}
-                
-                # Dynamisk avlesning av alle registre i registerMap
-                for key, config in registerMap.items():
-                    regAddr = config["register"]
-                    regType = config.get("type", "float")
-                    registerLength = config.get("length", "int")
-                    
-                    registerReader = modbusReaders[gatewayName]
-                    
-                    if regType == "float":
-                        val = registerReader.ReadFloat(regAddr, deviceId, registerLength)
-                    elif regType == "ascii":
-                        cacheKey = f"{tagName}_{key}"
-                        if cycleStart - lastReadTime.get(cacheKey, 0) > asciiReadInterval:
-                            val = registerReader.ReadAscii(regAddr, deviceId, config["length"])
-                            if val:
-                                lastKnownValues[cacheKey] = val
-                                lastReadTime[cacheKey] = cycleStart
-                        val = lastKnownValues.get(cacheKey, "Unknown")
-                    else:
-                        val = None
-                    
-                    currentRow[key] = val
+            # pymodbus sender én forespørsel av gangen per tilkobling, så tags på samme gateway
+            # leses fortsatt etter hverandre. Gatewayer leses parallelt, og retry-ventetid for
+            # én tag overlapper med avlesning av de andre.
+            # Tags på gatewayer som er nede hoppes over til de er tilkoblet igjen.
+            cycleRows = await asyncio.gather(*(
+                ReadTag(readPlan, cycleStart) for readPlan in readPlans
+                if gatewaySupervisors[readPlan[1]].online
+            ))
+
+            for currentRow in cycleRows:
+                tagName = currentRow["Tag"]
 
                 # 1. Oppdater global tilstand for API-et
                 currentCycleData[tagName] = currentRow
                 
-                # 2. Lagre til disk
-                AppendData(currentRow)
+                # 2. Legg i kø for lagring (skrives samlet etter syklusen)
+                storageExecutor.submit(storage.AppendData, currentRow)
                 
-                # 3. Sjekk for varslinger
+                # 3. Sjekk for varslinger (sendes av Discord-tråden, blokkerer ikke)
                 alerts = CheckAlerts(currentRow)
                 if alerts and (cycleStart - lastAlertTime.get(tagName, 0) > alertCooldown):
                     discord.SendEmbed({
@@ -305,25 +609,51 @@ def Run():
                     })
                     lastAlertTime[tagName] = cycleStart
 
+            # Én skriving/transaksjon for hele syklusen
+            storageExecutor.submit(storage.Flush).add_done_callback(LogStorageError)
+
             # Oppdater den globale variabelen atomisk etter at alle tags er lest
             latestReadings = currentCycleData
+            latestReadingsJson = orjson.dumps(currentCycleData, option=orjson.OPT_NON_STR_KEYS)
             logging.info(f"Cycle completed. {len(latestReadings)} tags updated.")
 
-            elapsed = time.time() - cycleStart
-            time.sleep(max(0, pollInterval - elapsed))
+            nextDeadline += pollInterval
+            now = time.monotonic()
+            if now > nextDeadline:
+                # Syklusen tok lenger tid enn pollInterval; synkroniser på nytt i stedet for å ta igjen
+                logging.warning(f"Cycle overran pollInterval by {now - nextDeadline:.2f}s")
+                nextDeadline = now + pollInterval
+            await asyncio.sleep(nextDeadline - now)
 
     except Exception as e:
         logging.error(f"Error in Run loop: {e}")
+        # Videreformidles slik at Main stopper API-et i stedet for å servere data fra en død monitor
+        raise
     finally:
-        client.close()
+        for task in supervisorTasks:
+            task.cancel()
+        storageExecutor.submit(storage.Close)
+        storageExecutor.shutdown(wait=True)
+        for client in modbusClients.values():
+            client.close()
         
 @app.route("/api/powertags", methods=["GET"])
-def GetPowertags():
-    return jsonify(latestReadings)
+async def GetPowertags():
+    # Serialisert én gang per syklus, ikke per forespørsel
+    return Response(latestReadingsJson, mimetype="application/json")
 
-if __name__ == "__main__":
-    # Monitor thread
-    monitorThread = threading.Thread(target=Run, daemon=True)
-    monitorThread.start()
+async def Main():
+    """ Summary of function: Runs the Modbus loop and the API on the same event loop """
+    monitorTask = asyncio.create_task(Run())
+    apiTask = asyncio.create_task(app.run_task(host="0.0.0.0", port=5000, debug=False))
 
-    app.run(host="0.0.0.0", port=5000, debug=False)
+    # Stopper begge hvis én av dem avslutter; feil fra Run gir ikke-null exit-kode
+    done, pending = await asyncio.wait({monitorTask, apiTask}, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    for task in done:
+        task.result()
+
+if __name__ == "__main__":
+    asyncio.run(Main())